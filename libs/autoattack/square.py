@@ -33,6 +33,10 @@ class SquareAttack():
     :param p_init:        parameter to control size of squares
     :param loss:          loss function optimized ('margin', 'ce' supported)
     :param resc_schedule  adapt schedule of p to n_queries
+    :param parallel_restarts  run all restarts in a single batched run
+    :param check_every    queries between early-stopping checks
+    :param compile        compile the forward pass of the query loop
+    :param bf16           run the query loop forward in bfloat16
     """
 
     def __init__(
@@ -47,6 +51,10 @@ class SquareAttack():
             verbose=False,
             loss='margin',
             resc_schedule=True,
+            parallel_restarts=False,
+            check_every=16,
+            compile=True,
+            bf16=False,
             device=None):
         """
         Square Attack implementation in PyTorch
@@ -61,7 +69,13 @@ class SquareAttack():
         self.verbose = verbose
         self.loss = loss
         self.rescale_schedule = resc_schedule
+        self.parallel_restarts = parallel_restarts
+        self.check_every = check_every
         self.device = device
+        self.compile = compile
+        self.bf16 = bf16
+        self.predict_query = None
+        self.eta_cache = {}
         # Dice loss
         self.dice_thresh = dice_thresh
         self.dice = Dice_metric(eps=1e-5)
@@ -71,8 +85,13 @@ class SquareAttack():
         :param y:        correct labels
         """
 
-        logits = self.predict(x)
-        dice = self.dice(logits.detach(), y)
+        # optionally query in bfloat16; x itself stays in float32 for the
+        # eps projection. Off by default: success is decided from these
+        # margins and argmax flips easily at bf16 precision
+        with torch.autocast(device_type=torch.device(self.device).type,
+                            dtype=torch.bfloat16, enabled=self.bf16):
+            logits = self.predict_query(x)
+        dice = self.dice(logits.detach().float(), y)
         return dice, dice # margin, margin
 
     def init_hyperparam(self, x):
@@ -85,86 +104,88 @@ class SquareAttack():
         self.ndims = len(self.orig_dim)
         if self.seed is None:
             self.seed = time.time()
+        # the attack loop calls predict with a fixed input shape thousands
+        # of times, so compile that forward once (torch >= 2.0). The clean
+        # and final checks keep the eager predict. reduce-overhead replays
+        # the forward as a CUDA graph; the rest of a query is a few
+        # elementwise ops and the square size changes with the p schedule,
+        # so the loop body itself is not captured
+        if self.predict_query is None:
+            self.predict_query = self.predict
+            if self.compile and hasattr(torch, 'compile'):
+                self.predict_query = torch.compile(
+                    self.predict, mode='reduce-overhead', dynamic=False)
+        self.p_table = self.p_schedule()
+        # sample directly on the attack device, no host to device copies
+        self.generator = torch.Generator(device=torch.device(self.device))
+        self.generator.manual_seed(int(self.seed))
 
     def random_target_classes(self, y_pred, n_classes):
-        y = torch.zeros_like(y_pred)
-        for counter in range(y_pred.shape[0]):
-            lst = list(range(n_classes))
-            lst.remove(y_pred[counter])
-            t = self.random_int(0, len(lst))
-            y[counter] = lst[t]
+        # draw among n_classes - 1 labels and shift past the true class
+        y_pred = y_pred.to(self.device)
+        y = self.random_int(0, n_classes - 1, y_pred.shape)
+        y = y + (y >= y_pred).long()
 
-        return y.long().to(self.device)
-
-    def check_shape(self, x):
-        return x if len(x.shape) == (self.ndims + 1) else x.unsqueeze(0)
+        return y
 
     def random_choice(self, shape):
-        t = 2 * torch.rand(shape).to(self.device) - 1
-        return torch.sign(t)
+        t = torch.empty(shape, device=self.device)
+        return t.bernoulli_(0.5, generator=self.generator).mul_(2).sub_(1)
 
     def random_int(self, low=0, high=1, shape=[1]):
-        t = low + (high - low) * torch.rand(shape).to(self.device)
-        return t.long()
+        # an empty range [low, low) collapses to low
+        return torch.randint(
+            low, max(high, low + 1), tuple(shape), device=self.device,
+            generator=self.generator)
+
+    def square_mask(self, start, s, size):
+        """ boolean [n, size] mask selecting [start, start + s) per row """
+        coords = torch.arange(size, device=self.device).view(1, -1)
+        return (coords >= start) & (coords < start + s)
 
     def normalize(self, x):
         t = x.abs().view(x.shape[0], -1).max(1)[0]
         return x / (t.view(-1, *([1] * self.ndims)) + 1e-12)
 
     def eta_rectangles(self, x, y):
-        delta = torch.zeros([x, y]).to(self.device)
         x_c, y_c = x // 2 + 1, y // 2 + 1
 
-        counter2 = [x_c - 1, y_c - 1]
-        for counter in range(0, max(x_c, y_c)):
-            delta[
-                max(counter2[0], 0):min(counter2[0] + (2*counter + 1), x),
-                max(0, counter2[1]):min(counter2[1] + (2*counter + 1), y)
-                ] += 1.0/(torch.Tensor([counter + 1]).view(1, 1).to(
-                    self.device) ** 2)
-            counter2[0] -= 1
-            counter2[1] -= 1
-
-        delta /= (delta ** 2).sum(dim=(0, 1), keepdim=True).sqrt()
-        return delta
+        # nested rectangles around the center: ring r receives
+        # 1 / (k + 1) ** 2 from every rectangle k >= r
+        ii, jj = np.ogrid[:x, :y]
+        ring = np.maximum(np.abs(ii - (x_c - 1)), np.abs(jj - (y_c - 1)))
+        weights = 1.0 / (np.arange(max(x_c, y_c)) + 1) ** 2
+        delta = np.cumsum(weights[::-1])[::-1][ring]
+
+        delta /= np.sqrt((delta ** 2).sum())
+        return torch.from_numpy(delta).float().to(self.device)
 
     def eta(self, s):
-        delta = torch.zeros([s, s]).to(self.device)
-        delta[:s // 2] = self.eta_rectangles(s // 2, s)
-        delta[s // 2:] = -1. * self.eta_rectangles(s - s // 2, s)
-        delta /= (delta ** 2).sum(dim=(0, 1), keepdim=True).sqrt()
+        # eta only depends on s, so build each size once and reuse it
+        if s not in self.eta_cache:
+            delta = torch.zeros([s, s]).to(self.device)
+            delta[:s // 2] = self.eta_rectangles(s // 2, s)
+            delta[s // 2:] = -1. * self.eta_rectangles(s - s // 2, s)
+            delta /= (delta ** 2).sum(dim=(0, 1), keepdim=True).sqrt()
+            self.eta_cache[s] = delta
+
+        delta = self.eta_cache[s]
         if torch.rand([1]) > 0.5:
             delta = delta.permute([1, 0])
 
         return delta
 
-    def p_selection(self, it):
-        """ schedule to decrease the parameter p """
+    def p_schedule(self):
+        """ schedule to decrease the parameter p, one entry per query """
 
+        it = np.arange(self.n_queries)
         if self.rescale_schedule:
-            it = int(it / self.n_queries * 10000)
-
-        if 10 < it <= 50:
-            p = self.p_init / 2
-        elif 50 < it <= 200:
-            p = self.p_init / 4
-        elif 200 < it <= 500:
-            p = self.p_init / 8
-        elif 500 < it <= 1000:
-            p = self.p_init / 16
-        elif 1000 < it <= 2000:
-            p = self.p_init / 32
-        elif 2000 < it <= 4000:
-            p = self.p_init / 64
-        elif 4000 < it <= 6000:
-            p = self.p_init / 128
-        elif 6000 < it <= 8000:
-            p = self.p_init / 256
-        elif 8000 < it:
-            p = self.p_init / 512
-        else:
-            p = self.p_init
-        return p
+            it = (it / self.n_queries * 10000).astype(np.int64)
+
+        # p is halved every time `it` goes past one of these boundaries
+        bounds = np.array([10, 50, 200, 500, 1000, 2000, 4000, 6000, 8000])
+        n_halvings = np.searchsorted(bounds, it, side='left')
+        return self.p_init / 2. ** n_halvings
 
     def attack_single_run(self, x, y):
         with torch.no_grad():
@@ -173,62 +194,69 @@ class SquareAttack():
             n_ex_total = x.shape[0]
             root_cube = lambda x: x**(1./3.) if 0 <= x else -(-x)**(1./3.)
 
+            # NDHWC lets cuDNN pick the faster 3D conv kernels; the buffers
+            # and in-place updates below keep this layout
+            x = x.contiguous(memory_format=torch.channels_last_3d)
             x_best = torch.clamp(x + self.eps * self.random_choice(
                 [x.shape[0], c, 1, h, w]), 0., 1.)
+            x_best = x_best.contiguous(memory_format=torch.channels_last_3d)
             margin_min, loss_min = self.margin_and_loss(x_best, y)
             n_queries = torch.ones(x.shape[0]).to(self.device)
+            # buffers reused by every query
+            square = torch.empty(
+                [n_ex_total, 1, d, h, w], dtype=torch.bool, device=self.device)
+            new_deltas = torch.zeros_like(x)
+            x_new = torch.empty_like(x)
             for i_iter in range(self.n_queries):
                 if i_iter % 100 == 0:
                     print(i_iter)
-                idx_to_fool = (margin_min > self.dice_thresh).nonzero().squeeze()
-                x_curr = self.check_shape(x[idx_to_fool])
-                x_best_curr = self.check_shape(x_best[idx_to_fool])
-                y_curr = y[idx_to_fool]
-                if len(y_curr.shape) == 3:
-                    y_curr = y_curr.unsqueeze(0)
-                margin_min_curr = margin_min[idx_to_fool]
-                loss_min_curr = loss_min[idx_to_fool]
-
-                p = self.p_selection(i_iter)
+                # keep the full batch so shapes stay static; samples that
+                # are already fooled get a no-op update through `active`
+                active = margin_min > self.dice_thresh
+
+                p = float(self.p_table[i_iter])
                 s = max(int(round(root_cube(p * n_features / c))), 1)
-                vd = self.random_int(0, d - s)
-                vh = self.random_int(0, h - s)
-                vw = self.random_int(0, w - s)
-                new_deltas = torch.zeros([c, d, h, w]).to(self.device)
-                new_deltas[
-                    :, vd:vd + s, vh:vh + s, vw:vw + s
-                    ] = 2. * self.eps * self.random_choice([c, 1, 1, 1])
-
-                x_new = x_best_curr + new_deltas
-                x_new = torch.min(torch.max(x_new, x_curr - self.eps),
-                                  x_curr + self.eps)
-                x_new = torch.clamp(x_new, 0., 1.)
-                x_new = self.check_shape(x_new)
-
-                margin, loss = self.margin_and_loss(x_new, y_curr)
+                # each image samples its own square location and sign
+                vd = self.random_int(0, d - s, [n_ex_total, 1])
+                vh = self.random_int(0, h - s, [n_ex_total, 1])
+                vw = self.random_int(0, w - s, [n_ex_total, 1])
+                in_d = self.square_mask(vd, s, d)
+                in_h = self.square_mask(vh, s, h)
+                in_w = self.square_mask(vw, s, w)
+                # copy_ broadcasts into the buffer instead of resizing it
+                square.copy_(
+                    in_d[:, None, :, None, None]
+                    & in_h[:, None, None, :, None])
+                square.logical_and_(in_w[:, None, None, None, :])
+                torch.mul(square, 2. * self.eps * self.random_choice(
+                    [n_ex_total, c, 1, 1, 1]), out=new_deltas)
+
+                # project onto the eps-ball around x and the image domain
+                torch.add(x_best, new_deltas, out=x_new)
+                x_new.sub_(x).clamp_(-self.eps, self.eps).add_(x).clamp_(0., 1.)
+
+                margin, loss = self.margin_and_loss(x_new, y)
                 # update loss if new loss is better
-                idx_improved = (loss < loss_min_curr).half()
+                idx_improved = (loss < loss_min) & active
 
-                loss_min[idx_to_fool] = idx_improved * loss + (
-                    1. - idx_improved) * loss_min_curr
+                loss_min = torch.where(idx_improved, loss, loss_min)
 
                 # update margin and x_best if new loss is better
                 # or misclassification
-                idx_miscl = (margin < self.dice_thresh).half()
-                idx_improved = torch.max(idx_improved, idx_miscl)
+                idx_miscl = (margin < self.dice_thresh) & active
+                idx_improved = idx_improved | idx_miscl
 
-                margin_min[idx_to_fool] = idx_improved * margin + (
-                    1. - idx_improved) * margin_min_curr
+                margin_min = torch.where(idx_improved, margin, margin_min)
                 idx_improved = idx_improved.reshape(
                     [-1, *[1]*len(x.shape[:-1])])
-                x_best[idx_to_fool] = idx_improved * x_new + (
-                    1. - idx_improved) * x_best_curr
-                n_queries[idx_to_fool] += 1.
-
-                curr_dice, _ = self.margin_and_loss(x_best, y)
-                ind_succ = (self.dice(
-                    self.predict(x_best).detach(),
-                    y) < self.dice_thresh).nonzero().squeeze()
+                x_best = torch.where(idx_improved, x_new, x_best)
+                n_queries += active.float()
+
+                # checking for success syncs with the device, so only do it
+                # every `check_every` queries
+                if (i_iter + 1) % self.check_every != 0:
+                    continue
+                ind_succ = (margin_min < self.dice_thresh).nonzero().view(-1)
                 if self.verbose and ind_succ.numel() != 0:
                     print(
                         '{}'.format(i_iter + 1),
@@ -255,32 +283,34 @@ class SquareAttack():
         self.init_hyperparam(x)
 
         adv = x.clone()
+        # a single clean forward serves both the labels and the accuracy
+        with torch.no_grad():
+            logits = self.predict(x).detach()
         if y is None:  # haven't studied this case, for now
-            with torch.no_grad():
-                output = self.predict(x)
-                y_pred = output.max(1)[1]
-                y = y_pred.detach().clone().long().to(self.device)
+            y_pred = logits.max(1)[1]
+            y = y_pred.clone().long().to(self.device)
         else:
             y = y.detach().clone().long().to(self.device)
 
-        acc = self.dice(self.predict(x).detach(), y) > self.dice_thresh
+        acc = self.dice(logits, y) > self.dice_thresh
 
         startt = time.time()
 
         torch.random.manual_seed(self.seed)
         torch.cuda.random.manual_seed(self.seed)
 
+        if self.parallel_restarts and self.n_restarts > 1:
+            return self.perturb_parallel_restarts(x, y, acc, adv, startt)
+
         for counter in range(self.n_restarts):
-            ind_to_fool = acc.nonzero().squeeze()
-            if len(ind_to_fool.shape) == 0:
-                ind_to_fool = ind_to_fool.unsqueeze(0)
+            ind_to_fool = acc.nonzero().view(-1)
             if ind_to_fool.numel() != 0:
                 x_to_fool = x[ind_to_fool].clone()
                 y_to_fool = y[ind_to_fool].clone()
 
                 _, adv_curr = self.attack_single_run(x_to_fool, y_to_fool)
                 acc_curr = self.dice(self.predict(adv_curr).detach(), y_to_fool) > self.dice_thresh
-                ind_curr = (acc_curr == 0).nonzero().squeeze()
+                ind_curr = (acc_curr == 0).nonzero().view(-1)
 
                 acc[ind_to_fool[ind_curr]] = 0
                 adv[ind_to_fool[ind_curr]] = adv_curr[ind_curr].clone()
@@ -290,4 +320,40 @@ class SquareAttack():
                         '- cum. time: {:.1f} s'.format(
                         time.time() - startt))
 
-        return adv_curr
+        return adv
+
+    def perturb_parallel_restarts(self, x, y, acc, adv, startt):
+        """
+        Runs all the restarts at once by stacking them along the batch
+        dimension, then keeps the restart with the lowest dice per sample.
+        """
+
+        ind_to_fool = acc.nonzero().view(-1)
+        if ind_to_fool.numel() == 0:
+            return adv
+
+        n_fool = ind_to_fool.numel()
+        x_to_fool = x[ind_to_fool].repeat(
+            self.n_restarts, *[1] * self.ndims)
+        y_to_fool = y[ind_to_fool].repeat(
+            self.n_restarts, *[1] * (y.ndimension() - 1))
+
+        _, adv_all = self.attack_single_run(x_to_fool, y_to_fool)
+        with torch.no_grad():
+            dice_all = self.dice(self.predict(adv_all).detach(), y_to_fool)
+        best = dice_all.view(self.n_restarts, n_fool).argmin(0)
+        adv_curr = adv_all.reshape(self.n_restarts, n_fool, *self.orig_dim)[
+            best, torch.arange(n_fool, device=best.device)]
+        acc_curr = dice_all.view(self.n_restarts, n_fool).min(0)[0] > \
+            self.dice_thresh
+        ind_curr = (acc_curr == 0).nonzero().view(-1)
+
+        acc[ind_to_fool[ind_curr]] = 0
+        adv[ind_to_fool[ind_curr]] = adv_curr[ind_curr].clone()
+        if self.verbose:
+            print('{} parallel restarts - robust accuracy: {:.2%}'.format(
+                self.n_restarts, acc.float().mean()),
+                '- cum. time: {:.1f} s'.format(
+                time.time() - startt))
+
+        return adv
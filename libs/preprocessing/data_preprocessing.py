@@ -6,12 +6,15 @@ data_root = '/datasets/MSD_data'
 out_directory = '/datasets/MSD_data/processed/'
 num_workers = 12
 
-# Calculate the statistics of the original dataset
-Global_features(data_root, num_workers)
+if __name__ == '__main__':
+    # Calculate the statistics of the original dataset
+    Global_features(data_root, num_workers)
 
-# # Preprocess the datasets
-Preprocess_datasets(out_directory, data_root, num_workers)
+    # Preprocess the datasets, the sizes of the training labels are
+    # calculated in the same pass
+    Preprocess_datasets(out_directory, data_root, num_workers)
 
-# Calculate the dataset sizes (used to plan the experiments)
-# out_directory = '/media/SSD0/ladaza/Data/Decathlon'
-Calcualte_sizes(out_directory, num_workers)
+    # Calculate the dataset sizes of any remaining task (used to plan the
+    # experiments)
+    # out_directory = '/media/SSD0/ladaza/Data/Decathlon'
+    Calcualte_sizes(out_directory, num_workers)
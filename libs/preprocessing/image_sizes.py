@@ -11,6 +11,10 @@ from utils import read_json
 
 def parallel_sizes(image, labels):
     im = nib.load(image).get_fdata()
+    return label_sizes(im, labels)
+
+
+def label_sizes(im, labels):
     struct = morphology.generate_binary_structure(3, 3)
     lb_sizes = []
     vol = []
@@ -37,6 +41,31 @@ def parallel_sizes(image, labels):
     return im.shape, np.asarray(lb_sizes), vol
 
 
+def sizes_file(task):
+    return os.path.join('../..', 'Tasks', task, 'dataset_prueba.json')
+
+
+def save_sizes(task, dataset, features):
+    mean_size, sizes, volumes = [list(x) for x in zip(*features)]
+    mean_size = np.median(mean_size, 0)
+    mean_size[-1] = np.minimum(mean_size[-1], 160)
+    sizes = np.round(np.mean(sizes, 0))
+    volumes = np.round(np.mean(volumes, 0))
+    order = np.argsort(volumes)
+
+    results = {
+        'mean_size': list(mean_size),
+        'small_size': list(sizes[order[0]]),
+        'volume_small': volumes[order[0]],
+        'big_size': list(sizes[order[-1]]),
+        'volume_big': volumes[order[-1]],
+        'modality': dataset['modality'],
+        'labels': dataset['labels']}
+
+    with open(sizes_file(task), 'w') as outfile:
+        json.dump(results, outfile, indent=4)
+
+
 def Calcualte_sizes(root, num_workers):
     tasks = [
         x for x in os.listdir(root)
@@ -44,8 +73,7 @@ def Calcualte_sizes(root, num_workers):
     tasks.sort()
 
     for task in tasks:
-        file_name = os.path.join('../..', 'Tasks', task, 'dataset_prueba.json')
-        if os.path.isfile(file_name):
+        if os.path.isfile(sizes_file(task)):
             print('Sizes of task {} already calculated'.format(task))
             continue
 
@@ -56,21 +84,4 @@ def Calcualte_sizes(root, num_workers):
         files = glob.glob(os.path.join(root, task, 'labelsTr/*.nii.gz'))
         features = Parallel(n_jobs=num_workers)(delayed(parallel_sizes)(
             i, labels) for i in files)
-        mean_size, sizes, volumes = [list(x) for x in zip(*features)]
-        mean_size = np.median(mean_size, 0)
-        mean_size[-1] = np.minimum(mean_size[-1], 160)
-        sizes = np.round(np.mean(sizes, 0))
-        volumes = np.round(np.mean(volumes, 0))
-        order = np.argsort(volumes)
-
-        results = {
-            'mean_size': list(mean_size),
-            'small_size': list(sizes[order[0]]),
-            'volume_small': volumes[order[0]],
-            'big_size': list(sizes[order[-1]]),
-            'volume_big': volumes[order[-1]],
-            'modality': dataset['modality'],
-            'labels': dataset['labels']}
-
-        with open(file_name, 'w') as outfile:
-            json.dump(results, outfile, indent=4)
+        save_sizes(task, dataset, features)
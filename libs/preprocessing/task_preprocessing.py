@@ -4,6 +4,13 @@ import numpy as np
 from joblib import Parallel, delayed
 
 from utils import read_json, preprocess, cases_list
+from image_sizes import label_sizes, parallel_sizes, save_sizes, sizes_file
+
+
+def preprocess_sizes(im, args, lb, labels):
+    # Measure the label while it is still in memory
+    label = preprocess(im, args, lb=lb)
+    return label_sizes(label, labels)
 
 
 def Preprocess_datasets(out_dir, root, workers):
@@ -31,8 +38,20 @@ def Preprocess_datasets(out_dir, root, workers):
             os.path.join(out_task, 'dataset.json'))
         print('----- Processing training set -----')
         patientsTr = cases_list(dataset, out_task, 'imagesTr', 'training')
-        Parallel(n_jobs=workers)(delayed(preprocess)(
-            i['image'], args, lb=i['label']) for i in patientsTr)
+        if os.path.isfile(sizes_file(x)):
+            Parallel(n_jobs=workers)(delayed(preprocess)(
+                i['image'], args, lb=i['label']) for i in patientsTr)
+        else:
+            # Calculate the dataset sizes in the same pass
+            labels = len(dataset['labels'])
+            features = Parallel(n_jobs=workers)(delayed(preprocess_sizes)(
+                i['image'], args, i['label'], labels) for i in patientsTr)
+            processed = [
+                i for i in dataset['training'] if i not in patientsTr]
+            features += Parallel(n_jobs=workers)(delayed(parallel_sizes)(
+                os.path.join(out_task, i['label']), labels)
+                for i in processed)
+            save_sizes(x, dataset, features)
 
         print('----- Processing test set -----')
         patientsTs = cases_list(dataset, out_task, 'imagesTs', 'test')
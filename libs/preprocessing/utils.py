@@ -79,6 +79,7 @@ def preprocess(im, args, lb=None):
 
     print('Patient {} processed. Original shape: {}. Final shape: {}'.format(
         im, in_shape, image.shape[:3]))
+    return label
 
 
 def normalize(im, limits, stats, CT):
@@ -71,15 +71,16 @@ class Dice_metric(nn.Module):
 
     def forward(self, inputs, targets, logits=True):
         categories = inputs.shape[1]
-        targets = targets.contiguous()
+        targets = targets.to(inputs.device).contiguous()
         targets = one_hot(targets, categories)
         if logits:
-            inputs = torch.argmax(F.softmax(inputs, dim=1), dim=1)
+            # softmax is monotonic, the argmax of the logits is the same
+            inputs = torch.argmax(inputs, dim=1)
         inputs = one_hot(inputs, categories)
 
         dims = tuple(range(2, targets.ndimension()))
         tps = torch.sum(inputs * targets, dims)
-        fps = torch.sum(inputs * (1 - targets), dims)
-        fns = torch.sum((1 - inputs) * targets, dims)
-        loss = (2 * tps) / (2 * tps + fps + fns + self.eps)
+        # 2 * tps + fps + fns == |inputs| + |targets| for one-hot maps
+        total = torch.sum(inputs, dims) + torch.sum(targets, dims)
+        loss = (2 * tps) / (total + self.eps)
         return loss[:, 1:].mean(dim=1)
\ No newline at end of file
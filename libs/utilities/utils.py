@@ -87,7 +87,7 @@ def one_hot(gt, categories):
     # Check the new function in PyTorch!!!
     size = [*gt.shape] + [categories]
     y = gt.view(-1, 1)
-    gt = torch.FloatTensor(y.nelement(), categories).zero_().cuda()
+    gt = torch.zeros(y.nelement(), categories, device=y.device)
     gt.scatter_(1, y, 1)
     gt = gt.view(size).permute(0, 4, 1, 2, 3).contiguous()
     return gt
@@ -10,7 +10,7 @@ class SeparableConv3d(nn.Module):
         self.conv = nn.Conv3d(
             inplanes, inplanes, kernel_size, stride, padding, dilation,
             groups=inplanes, bias=bias)
-        self.pointwise = nn.Conv3d(inplanes, planes, 1, 1, 0, 1, 1, bias=bias)
+        self.pointwise = nn.Conv3d(inplanes, planes, kernel_size=1, bias=bias)
 
     def forward(self, x):
         x = self.conv(x)
@@ -0,0 +1,37 @@
+import torch
+import torch.nn as nn
+
+from libs.autoattack.square import SquareAttack
+
+
+def run_square(parallel_restarts, n=3, dice_thresh=0.5):
+    torch.manual_seed(0)
+    model = nn.Conv3d(1, 2, 3, padding=1)
+    x = torch.rand(n, 1, 8, 8, 8)
+    with torch.no_grad():
+        y = model(x).argmax(1)
+    eps = 8. / 255.
+    attack = SquareAttack(
+        model, dice_thresh=dice_thresh, n_queries=20, eps=eps, n_restarts=3,
+        parallel_restarts=parallel_restarts, compile=False, device='cpu')
+    return x, attack.perturb(x, y), eps
+
+
+def test_square_perturb():
+    x, adv, eps = run_square(parallel_restarts=False)
+    assert adv.shape == x.shape
+    assert (adv - x).abs().max() <= eps + 1e-6
+    assert adv.min() >= 0. and adv.max() <= 1.
+
+
+def test_square_perturb_parallel_restarts():
+    x, adv, eps = run_square(parallel_restarts=True)
+    assert adv.shape == x.shape
+    assert (adv - x).abs().max() <= eps + 1e-6
+
+
+def test_square_perturb_nothing_robust():
+    # no sample passes the threshold, the clean batch comes back unchanged
+    for parallel_restarts in (False, True):
+        x, adv, _ = run_square(parallel_restarts, dice_thresh=1.1)
+        assert torch.equal(adv, x)